@@ -1,130 +1,611 @@
+from __future__ import annotations
+
 import re
 import os
 import argparse
+import codecs
+import functools
 import glob
+import hashlib
 import json
 import logging
-
-def is_binary_file(filepath):
+import mmap
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, Iterator, Optional, Union
+
+try:
+    import re2  # type: ignore
+except ImportError:
+    re2 = None  # google-re2 is optional; --re2 falls back to re without it
+
+logger = logging.getLogger(__name__)
+
+# Files at least this large are handed to worker processes one at a time
+LARGE_FILE_SIZE = 1024 * 1024
+
+# Name of the result cache used by --cache inside the git directory, and its
+# location outside a git work tree (add it to .gitignore there)
+CACHE_NAME = 'clean_file_paths.cache.json'
+CACHE_PATH = '.clean_file_paths.cache.json'
+
+# Bump whenever a change to the cleaning logic can change which files need cleaning,
+# so caches written by older versions are discarded
+CACHE_VERSION = 1
+
+# The module is fully annotated so it can be compiled with mypyc
+# (`mypyc clean_file_paths.py`) to cut interpreter overhead in the per-match
+# callbacks; the plain .py source is used wherever no compiled build is present.
+CompiledPatterns = list[tuple[Any, Callable[[Any], str], Optional[tuple[str, ...]], bool]]
+Literals = Optional[tuple[list[bytes], Optional['re.Pattern[bytes]'], bool]]
+Buffer = Union[bytes, mmap.mmap]
+
+# Extensions that are never text, so these files are skipped without being opened
+BINARY_EXTENSIONS = (
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.pdf',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.tar', '.jar', '.whl',
+    '.so', '.dll', '.dylib', '.exe', '.o', '.a', '.pyc', '.class',
+    '.bin', '.pkl', '.parquet', '.bam', '.pgen',
+)
+
+# ASCII letters that re.IGNORECASE also matches to non-ASCII characters on str
+# patterns ('İ' and 'ı' for 'i', 'K' for 'k', 'ſ' for 's'); bytes patterns fold ASCII only
+UNICODE_FOLDED_LETTERS = frozenset('iks')
+
+NON_ASCII = re.compile(rb'[^\x00-\x7f]')
+
+# Everything re's \s matches on str patterns, as the body of an RE2 character class
+RE2_WHITESPACE = r'\t\n\x0b\x0c\r\x1c-\x1f \x{85}\x{a0}\x{1680}\x{2000}-\x{200a}\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}'
+
+# Escapes and class brackets in a pattern; anything else is copied through as is
+RE2_TOKEN = re.compile(r'\\.|\[\^?\]?|\]|[^\\\[\]]+', re.DOTALL)
+
+# Only the first 8 KiB of a file is inspected for NUL bytes, in a single C-level
+# scan of the buffer that was already read (git uses a similar 8000-byte window)
+BINARY_CHECK_SIZE = 8192
+
+def is_binary(data: Buffer) -> bool:
+    return data.find(b'\0', 0, BINARY_CHECK_SIZE) != -1
+
+def replace_with_directory(replacement: Any, match: Any) -> str:
+    filename = match.group('filename')
+    new_path = os.path.join(replacement, filename)
+    return new_path
+
+def replace_with_filename(replacements: dict[str, Any], match: Any) -> str:
+    # Each alternative of a fused pattern is captured as k0..kN and is the last group
+    # to close in a match, so match.lastgroup names the alternative that matched
+    full_path = match.group(0)
+    filename = os.path.basename(full_path)
+    new_path = os.path.join(replacements[match.lastgroup], filename)
+    return new_path
+
+def replace_value(replacements: dict[str, Any], match: Any) -> str:
+    # The matched alternative's text is the key itself
+    name = match.lastgroup
+    return f"{match.group(name)} = {replacements[name]}"
+
+def re2_pattern(pattern: str) -> str:
+    # RE2's \s only matches ASCII whitespace, so it is spelled out as the Unicode
+    # whitespace that \s matches in re (such as '\xa0' and '\u2003')
+    parts = []
+    in_class = False
+    for match in RE2_TOKEN.finditer(pattern):
+        token = match.group(0)
+        if token == r'\s':
+            token = RE2_WHITESPACE if in_class else f'[{RE2_WHITESPACE}]'
+        elif token.startswith('[') and not in_class:
+            in_class = True
+        elif token == ']':
+            in_class = False
+        parts.append(token)
+    return ''.join(parts)
+
+def compile_regex(pattern: str, flags: int, use_re2: bool = False) -> Any:
+    # RE2 matches in linear time without backtracking, but only supports a subset
+    # of re syntax (no backreferences or lookarounds), so fall back to re for
+    # anything it rejects. RE2 also folds case differently: it never matches 'İ' or
+    # 'ı' to 'i' as re.IGNORECASE does, so case-insensitive patterns that can match
+    # an 'i' (or any non-ASCII text) are left to re.
+    if use_re2 and re2 is not None:
+        if flags & re.IGNORECASE and (not pattern.isascii() or 'i' in pattern.lower() or 'a-z' in pattern):
+            logger.info("Falling back to re for case-insensitive pattern '%s'", pattern)
+            return re.compile(pattern, flags)
+        try:
+            return re2.compile(f'(?i){re2_pattern(pattern)}' if flags & re.IGNORECASE else re2_pattern(pattern))
+        except re2.error as e:
+            logger.info("Falling back to re for pattern '%s': %s", pattern, e)
+    return re.compile(pattern, flags)
+
+def compile_patterns(patterns: dict[str, dict[str, Any]], use_re2: bool = False) -> CompiledPatterns:
+    # Compile every pattern once per run so clean_file never calls re.compile.
+    # Consecutive assignment patterns sharing the same flags are fused into a single
+    # alternation, so each file is scanned once per group instead of once per pattern.
+    # Groups are applied in config order, and a pattern starts a new group when an
+    # earlier pattern's output may contain its text, so that it still rewrites that
+    # output as it did when every pattern ran in its own pass. Path patterns keep one
+    # pass each: a later path pattern may rescan the file name kept from an earlier
+    # match, which cannot be predicted from the config.
+    # Each entry also carries the literal needles that must occur in the content for
+    # the group to match (None when there are none) and whether to compare them
+    # case-insensitively.
+    entries: list[Any] = []
+    group: Optional[dict[str, Any]] = None
+    for pattern, options in patterns.items():
+        replacement = options.get("replacement")
+        inplace = options.get("inplace", False)
+        case_sensitive = options.get("case_sensitive", True)
+
+        # Adjust regex pattern for case sensitivity
+        flags = 0 if case_sensitive else re.IGNORECASE
+
+        if inplace and pattern == "all":
+            # This handles the "all" case, replacing all paths with the replacement directory
+            regex = compile_regex(r'(/[^/\s]+)+/(?P<filename>[^/]+\.[a-zA-Z0-9]+)', flags, use_re2)
+            entries.append((regex, functools.partial(replace_with_directory, replacement), None, False))
+            group = None
+            continue
+
+        needle = pattern if case_sensitive else pattern.lower()
+        if (
+            group is None
+            or inplace
+            or (group['inplace'], group['flags']) != (bool(inplace), flags)
+            or any(needle in output for output in group['outputs'])
+        ):
+            group = {'inplace': bool(inplace), 'flags': flags, 'escaped': [], 'replacements': [], 'needles': [], 'outputs': []}
+            entries.append(group)
+        group['escaped'].append(re.escape(pattern))
+        group['replacements'].append(replacement)
+        group['needles'].append(needle)
+        # Assignments write the matched key and the replacement
+        outputs = [str(replacement), pattern]
+        group['outputs'].extend(outputs if case_sensitive else [output.lower() for output in outputs])
+
+    compiled: CompiledPatterns = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            compiled.append(entry)
+            continue
+        flags = entry['flags']
+        replacements = {f'k{i}': replacement for i, replacement in enumerate(entry['replacements'])}
+        alternation = '|'.join(f'(?P<k{i}>{p})' for i, p in enumerate(entry['escaped']))
+        if entry['inplace']:
+            # Pattern to find file paths that start with the given pattern
+            regex = compile_regex(
+                rf'(?:{alternation})[^\s]*',  # Match pattern followed by any non-space characters (to match the full path)
+                flags,
+                use_re2
+            )
+            # Replace the matched path with the replacement value followed by the filename (keeping the extension)
+            callback = functools.partial(replace_with_filename, replacements)
+        else:
+            # Pattern for matching variable assignment
+            regex = compile_regex(
+                rf'(?:{alternation})\s*=\s*[^\n]*',
+                flags,
+                use_re2
+            )
+            callback = functools.partial(replace_value, replacements)
+        needles: Optional[tuple[str, ...]] = tuple(entry['needles'])
+        if flags & re.IGNORECASE and not all(needle.isascii() for needle in entry['needles']):
+            # re.IGNORECASE folds non-ASCII patterns onto text that str.lower() does not
+            # reach (such as 'ſ' onto 's'), so these groups are never filtered
+            needles = None
+        compiled.append((regex, callback, needles, bool(flags & re.IGNORECASE)))
+    return compiled
+
+class PatternCleaner:
+    # Applies the compiled pattern groups through a function generated for this exact
+    # config, so the per-file path has no loop over groups, no branching on group
+    # options and the needle checks are inlined as string constants. Pickling sends
+    # only the compiled patterns; worker processes regenerate the function.
+
+    def __init__(self, compiled_patterns: CompiledPatterns) -> None:
+        self.compiled_patterns = compiled_patterns
+        self.run = self.generate()
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (PatternCleaner, (self.compiled_patterns,))
+
+    def generate(self) -> Callable[[str], tuple[int, str]]:
+        namespace: dict[str, Any] = {}
+        lines = ['def run(content):', '    replaced = 0']
+        # Index of the last group whose needles are checked against the lowered content,
+        # which is computed once and only recomputed after a group changed the content
+        last_lowered = max(
+            (index for index, (_, _, needles, ignore_case) in enumerate(self.compiled_patterns)
+             if needles is not None and ignore_case),
+            default=-1,
+        )
+        if last_lowered >= 0:
+            lines.append('    lowered = None')
+        for index, (regex, callback, needles, ignore_case) in enumerate(self.compiled_patterns):
+            namespace[f'pattern{index}'] = regex
+            namespace[f'callback{index}'] = callback
+            # Skip the regex pass when none of the group's literals occur in the content.
+            # Non-ASCII text is never filtered case-insensitively, since re.IGNORECASE
+            # folds some characters (such as 'ſ' and 's') that str.lower() does not.
+            indent = '    '
+            if needles is not None and not ignore_case:
+                lines.append(f"    if {' or '.join(f'{needle!r} in content' for needle in needles)}:")
+                indent = '        '
+            elif needles is not None:
+                lines += [
+                    '    if lowered is None:',
+                    '        lowered = content.lower() if content.isascii() else False',
+                    f"    if lowered is False or {' or '.join(f'{needle!r} in lowered' for needle in needles)}:",
+                ]
+                indent = '        '
+            # subn() reports whether anything matched at no extra cost; the content is only
+            # compared when it did, to ignore replacements that reproduce the matched text
+            lines += [
+                f'{indent}new_content, count = pattern{index}.subn(callback{index}, content)',
+                f'{indent}if count and new_content != content:',
+                f'{indent}    replaced += count',
+                f'{indent}    content = new_content',
+            ]
+            if index < last_lowered:
+                lines.append(f'{indent}    lowered = None')
+        lines.append('    return replaced, content')
+        exec(compile('\n'.join(lines), '<clean_file_paths>', 'exec'), namespace)
+        run: Callable[[str], tuple[int, str]] = namespace['run']
+        return run
+
+def extract_literals(patterns: dict[str, dict[str, Any]]) -> Literals:
+    # Every pattern except "all" starts with its own literal text, so a file containing
+    # none of these byte strings cannot match and is skipped before any regex work.
+    # Returns None when no such prefilter is possible.
+    sensitive, insensitive = [], []
+    unicode_folds = False
+    for pattern, options in patterns.items():
+        if options.get("inplace", False) and pattern == "all":
+            return None
+        if options.get("case_sensitive", True):
+            sensitive.append(pattern.encode('utf-8'))
+        elif pattern.isascii():
+            # Bytes patterns only fold ASCII case, which is enough for ASCII patterns
+            # unless they contain a letter that also folds to a non-ASCII character
+            insensitive.append(re.escape(pattern.encode('utf-8')))
+            unicode_folds = unicode_folds or not UNICODE_FOLDED_LETTERS.isdisjoint(pattern.lower())
+        else:
+            return None
+    probe = re.compile(b'|'.join(insensitive), re.IGNORECASE) if insensitive else None
+    return sensitive, probe, unicode_folds
+
+def contains_literal(data: Buffer, literals: tuple[list[bytes], Optional[re.Pattern[bytes]], bool]) -> bool:
+    # Uses find() rather than `in`, which tests for single byte values on an mmap
+    sensitive, probe, unicode_folds = literals
+    if any(data.find(literal) != -1 for literal in sensitive):
+        return True
+    if probe is not None and probe.search(data) is not None:
+        return True
+    # Non-ASCII text may still match through folds the bytes probe cannot see
+    return unicode_folds and NON_ASCII.search(data) is not None
+
+def read_file(file: BinaryIO) -> Buffer:
+    # Files larger than a page are memory-mapped, so files that turn out to need
+    # no changes are paged in by the kernel instead of copied into Python memory
+    if os.fstat(file.fileno()).st_size < mmap.PAGESIZE:
+        return file.read()
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def write_in_place(target: str, content: str) -> None:
+    with open(target, 'wb') as file:
+        file.write(content.encode('utf-8'))
+
+def copy_owner(path: str, st: os.stat_result) -> bool:
+    # Gives path the owner and group recorded in st; False when that is not permitted
+    current = os.stat(path)
+    if (current.st_uid, current.st_gid) == (st.st_uid, st.st_gid):
+        return True
     try:
-        with open(filepath, 'rb') as file:
-            for block in iter(lambda: file.read(1024), b''):
-                if b'\0' in block:
-                    return True
+        os.chown(path, st.st_uid, st.st_gid)
+    except OSError:
         return False
-    except Exception:
-        return False  # Assume non-binary on error
-
-def clean_file(filepath, patterns):
+    return True
+
+def write_file(filepath: str, content: str) -> None:
+    # Write to a temporary file next to the target and swap it in, so an interrupted
+    # run never leaves a half-written file behind. Symlinks are resolved so the link
+    # itself is not replaced by a regular file. The swap gives the path a new inode,
+    # so files with other hard links, files whose owner cannot be kept and targets in
+    # directories where no temporary file can be created are written in place instead.
+    target = os.path.realpath(filepath)
+    try:
+        st: Optional[os.stat_result] = os.stat(target)
+    except FileNotFoundError:
+        st = None
+    if st is not None and st.st_nlink > 1:
+        write_in_place(target, content)
+        return
+    try:
+        file = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(target), delete=False)
+    except OSError:
+        write_in_place(target, content)
+        return
+    try:
+        with file:
+            file.write(content.encode('utf-8'))
+        if st is not None and not copy_owner(file.name, st):
+            os.unlink(file.name)
+            write_in_place(target, content)
+            return
+        if st is not None:
+            shutil.copymode(target, file.name)
+        os.replace(file.name, target)
+    except BaseException:
+        if os.path.exists(file.name):
+            os.unlink(file.name)
+        raise
+
+def clean_file(filepath: str, cleaner: PatternCleaner, literals: Literals = None) -> Optional[bool]:
+    # Returns True when the file was modified, False when it was checked and needed no
+    # changes, and None when it could not be checked (so it must not be cached as clean)
     # Skip .json and .yaml files
     if filepath.endswith(('config.json', '.pre-commit-config.yaml', '.yml')):
-        logging.info(f"Skipping file: {filepath}")
+        logger.info("Skipping file: %s", filepath)
         return False
 
-    if is_binary_file(filepath):
-        logging.info(f"Skipping binary file: {filepath}")
+    if filepath.lower().endswith(BINARY_EXTENSIONS):
+        logger.info("Skipping binary file: %s", filepath)
         return False
-    
+
     try:
-        with open(filepath, 'r', encoding='utf-8') as file:
-            content = file.read()
-
-        logging.info(f"Original content of {filepath}:\n{content[:200]}")  # Show first 200 characters for brevity
-
-        cleaned_content = content
-        for pattern, options in patterns.items():
-            replacement = options.get("replacement")
-            inplace = options.get("inplace", False)
-            case_sensitive = options.get("case_sensitive", True)
-
-            # Adjust regex pattern for case sensitivity
-            flags = 0 if case_sensitive else re.IGNORECASE
-
-            if inplace:
-                if pattern == "all":
-                    # This handles the "all" case, replacing all paths with the replacement directory
-                    flexible_pattern = re.compile(r'(/[^/\s]+)+/(?P<filename>[^/]+\.[a-zA-Z0-9]+)', flags)
-                    
-                    def replace_with_directory(match):
-                        filename = match.group('filename')
-                        new_path = os.path.join(replacement, filename)
-                        logging.info(f"Replacing full path with '{new_path}'")
-                        return new_path
-
-                    cleaned_content = flexible_pattern.sub(replace_with_directory, cleaned_content)
-                else:
-                    # Pattern to find file paths that start with the given pattern
-                    flexible_pattern = re.compile(
-                        rf'{re.escape(pattern)}[^\s]*',  # Match pattern followed by any non-space characters (to match the full path)
-                        flags
-                    )
-
-                    # Replace the matched path with the replacement value followed by the filename (keeping the extension)
-                    def replace_with_filename(match):
-                        full_path = match.group(0)
-                        filename = os.path.basename(full_path)
-                        new_path = os.path.join(replacement, filename)
-                        logging.info(f"Replacing path '{full_path}' with '{new_path}'")
-                        return new_path
-
-                    cleaned_content = flexible_pattern.sub(replace_with_filename, cleaned_content)
-            else:
-                # Pattern for matching variable assignment
-                assignment_pattern = re.compile(
-                    rf'(?P<key>{re.escape(pattern)})(\s*=\s*)(?P<value>[^\n]*)',
-                    flags
-                )
-                def replace_value(match):
-                    key = match.group('key')
-                    logging.info(f"Replacing value for key '{key}' with {replacement}")
-                    return f"{key} = {replacement}"
-
-                cleaned_content = assignment_pattern.sub(replace_value, cleaned_content)
-
-        if content != cleaned_content:
-            logging.info(f"Modified content of {filepath}:\n{cleaned_content[:200]}")  # Show first 200 characters for brevity
-            with open(filepath, 'w', encoding='utf-8') as file:
-                file.write(cleaned_content)
-            logging.info(f"File modified: {filepath}")
+        # Read the file once and reuse the buffer for the binary check, the literal
+        # prefilter and the decode
+        with open(filepath, 'rb') as file:
+            data = read_file(file)
+
+        try:
+            if not data:
+                logger.info("Skipping empty file: %s", filepath)
+                return False
+
+            if is_binary(data):
+                logger.info("Skipping binary file: %s", filepath)
+                return False
+
+            if literals is not None and not contains_literal(data, literals):
+                logger.info("No changes needed for file: %s", filepath)
+                return False
+
+            if isinstance(data, mmap.mmap):
+                # Validate the first block before copying the whole mapping, so files in
+                # another encoding fail on their first bad byte
+                codecs.getincrementaldecoder('utf-8')().decode(data[:BINARY_CHECK_SIZE])
+            content = data[:].decode('utf-8')
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+        if '\r' in content:
+            # Normalize line endings the way text-mode open() does
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Original content of %s:\n%s", filepath, content[:200])  # Show first 200 characters for brevity
+
+        replaced, cleaned_content = cleaner.run(content)
+
+        if replaced:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Modified content of %s:\n%s", filepath, cleaned_content[:200])  # Show first 200 characters for brevity
+            write_file(filepath, cleaned_content)
+            logger.info("File modified: %s (%d replacements)", filepath, replaced)
             return True
         else:
-            logging.info(f"No changes needed for file: {filepath}")
+            logger.info("No changes needed for file: %s", filepath)
             return False
 
-    except Exception as e:
-        logging.error(f"Error cleaning file {filepath}: {e}")
+    except UnicodeDecodeError:
+        # Not UTF-8 text, so treat it like a binary file rather than an error
+        logger.info("Skipping non-UTF-8 file: %s", filepath)
         return False
 
-def clean_files(patterns, include_dirs=None, enforce_all=False):
+    except Exception as e:
+        logger.error("Error cleaning file %s: %s", filepath, e)
+        return None
+
+def include_prefixes(include_dirs: list[str]) -> tuple[str, ...]:
+    # Directories end with a separator so "src" does not also match "src_old"
+    return tuple(
+        os.path.abspath(include_dir) + os.sep if os.path.isdir(include_dir) else os.path.abspath(include_dir)
+        for include_dir in include_dirs
+    )
+
+def walk_files(root: str, prefixes: Optional[tuple[str, ...]] = None) -> Iterator[str]:
+    # os.scandir entries cache their type, so no extra stat() per entry is needed.
+    # With prefixes, only files below one of them are yielded and subtrees that
+    # cannot contain one are never entered.
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return  # Skip unreadable directories, as os.walk does
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if prefixes is None:
+                yield from walk_files(entry.path)
+                continue
+            dir_prefix = os.path.abspath(entry.path) + os.sep
+            if dir_prefix.startswith(prefixes):
+                # Everything below an included directory is included
+                yield from walk_files(entry.path)
+            elif any(prefix.startswith(dir_prefix) for prefix in prefixes):
+                yield from walk_files(entry.path, prefixes)
+        elif entry.is_file():
+            if prefixes is None or os.path.abspath(entry.path).startswith(prefixes):
+                yield entry.path
+
+def git_files(prefixes: Optional[tuple[str, ...]] = None) -> Optional[list[str]]:
+    # Lists tracked and untracked-but-not-ignored files from git, so .gitignore'd
+    # trees such as node_modules or venv (and .git itself) are never read.
+    # Returns None outside a git work tree or when git is not installed.
+    try:
+        result = subprocess.run(
+            ['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard'],
+            capture_output=True,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    files = []
+    # Unmerged paths are listed once per stage, so dedupe while keeping git's order
+    for name in dict.fromkeys(result.stdout.split(b'\0')):
+        if not name:
+            continue
+        filepath = os.path.join('.', os.fsdecode(name))
+        # Deleted files and submodules are still listed by git
+        if not os.path.isfile(filepath):
+            continue
+        if prefixes is None or os.path.abspath(filepath).startswith(prefixes):
+            files.append(filepath)
+    return files
+
+def list_files(prefixes: Optional[tuple[str, ...]] = None, use_gitignore: bool = True) -> list[str]:
+    if use_gitignore:
+        files = git_files(prefixes)
+        if files is not None:
+            return files
+    return list(walk_files('.', prefixes))
+
+def patterns_digest(patterns: dict[str, dict[str, Any]], use_re2: bool = False) -> str:
+    # The engine is part of the key since re and RE2 may not match the same text
+    key = {'version': CACHE_VERSION, 're2': use_re2 and re2 is not None, 'patterns': patterns}
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+def load_cache(cache_path: str, digest: str) -> dict[str, list[int]]:
+    # Maps each path to the [mtime_ns, size] it had when it last needed no changes.
+    # The whole cache is dropped when the patterns, the engine or CACHE_VERSION change.
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('patterns') != digest:
+        return {}
+    files = cache.get('files')
+    if not isinstance(files, dict):
+        return {}
+    return files
+
+def default_cache_path() -> str:
+    # Keep the cache inside the git directory, where `git add .` never picks it up
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--git-path', CACHE_NAME],
+            capture_output=True,
+            check=True,
+            text=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return CACHE_PATH
+    return result.stdout.strip()
+
+def save_cache(cache_path: str, digest: str, files: dict[str, list[int]]) -> None:
+    try:
+        write_file(cache_path, json.dumps({'patterns': digest, 'files': files}))
+    except OSError as e:
+        logger.warning("Could not write cache %s: %s", cache_path, e)
+
+# Cleaner and literals installed once per worker process by init_worker
+worker_state: dict[str, Any] = {}
+
+def init_worker(cleaner: PatternCleaner, literals: Literals) -> None:
+    worker_state['cleaner'] = cleaner
+    worker_state['literals'] = literals
+
+def clean_file_in_worker(filepath: str) -> Optional[bool]:
+    return clean_file(filepath, worker_state['cleaner'], worker_state['literals'])
+
+def clean_in_pool(cleaner: PatternCleaner, literals: Literals, all_files: list[str], jobs: int) -> list[Optional[bool]]:
+    # Largest files are dispatched first and one at a time, so a big file picked up
+    # last does not keep one worker busy long after the others are idle; the many
+    # small files are batched to amortize the inter-process round trips
+    sizes = {}
+    for filepath in all_files:
+        try:
+            sizes[filepath] = os.stat(filepath).st_size
+        except OSError:
+            sizes[filepath] = 0
+    ordered = sorted(all_files, key=sizes.__getitem__, reverse=True)
+    large = [filepath for filepath in ordered if sizes[filepath] >= LARGE_FILE_SIZE]
+    small = ordered[len(large):]
+    # The cleaner is handed to each worker once, rather than pickled into every task
+    # where each unpickling would recompile the patterns and regenerate run()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(cleaner, literals)) as executor:
+        # Submit both batches before waiting on either
+        large_results = executor.map(clean_file_in_worker, large, chunksize=1)
+        small_results = executor.map(clean_file_in_worker, small, chunksize=64)
+        results = dict(zip(large, large_results))
+        results.update(zip(small, small_results))
+    return [results[filepath] for filepath in all_files]
+
+def clean_files(patterns: dict[str, dict[str, Any]], include_dirs: Optional[list[str]] = None, enforce_all: bool = False, jobs: int = 1, use_re2: bool = False, cache_path: Optional[str] = None, use_gitignore: bool = True) -> int:
     all_files = []
     if enforce_all:
-        for root, _, files in os.walk('.'):
-            for file in files:
-                filepath = os.path.join(root, file)
-                if include_dirs:
-                    if any(os.path.abspath(filepath).startswith(os.path.abspath(include_dir)) for include_dir in include_dirs):
-                        all_files.append(filepath)
-                else:
-                    all_files.append(filepath)
+        if include_dirs:
+            all_files = list_files(include_prefixes(include_dirs), use_gitignore)
+        else:
+            all_files = list_files(use_gitignore=use_gitignore)
     else:
         # Simulate git diff --cached to list only relevant files
-        all_files = [os.path.join(root, file) for root, _, files in os.walk('.') for file in files]
+        all_files = list_files(use_gitignore=use_gitignore)
+
+    if cache_path:
+        # Skip files that needed no changes last run and have not changed since
+        digest = patterns_digest(patterns, use_re2)
+        cached = load_cache(cache_path, digest)
+        abs_cache_path = os.path.abspath(cache_path)
+        cache: dict[str, list[int]] = {}
+        stats: dict[str, list[int]] = {}
+        pending = []
+        for filepath in all_files:
+            if os.path.abspath(filepath) == abs_cache_path:
+                continue
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            stat_key = [st.st_mtime_ns, st.st_size]
+            if cached.get(filepath) == stat_key:
+                cache[filepath] = stat_key
+            else:
+                stats[filepath] = stat_key
+                pending.append(filepath)
+        all_files = pending
+
+    cleaner = PatternCleaner(compile_patterns(patterns, use_re2))
+    literals = extract_literals(patterns)
+    if jobs > 1:
+        # Files are cleaned independently, so spread them over worker processes
+        results = clean_in_pool(cleaner, literals, all_files, jobs)
+    else:
+        results = [clean_file(filepath, cleaner, literals) for filepath in all_files]
+    modified_files = [filepath for filepath, modified in zip(all_files, results) if modified]
+
+    if cache_path:
+        for filepath, modified in zip(all_files, results):
+            # Files that failed to be read or written are checked again next run
+            if modified is False:
+                cache[filepath] = stats[filepath]
+        save_cache(cache_path, digest, cache)
 
-    modified_files = []
-    for filepath in all_files:
-        if os.path.exists(filepath):
-            if clean_file(filepath, patterns):
-                modified_files.append(filepath)
-    
     if modified_files:
         # Re-stage modified files (for a git environment)
         return 1  # Return non-zero to indicate modifications
     return 0
 
-def main():
+def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument('--json-config', help='Path to JSON config file', type=str)
     parser.add_argument('--enforce-all', action='store_true', help='Enforce cleaning all relevant files, not just staged files')
+    parser.add_argument('--re2', action='store_true', help='Match with google-re2 when it is installed (linear-time, no backtracking). Patterns RE2 cannot express, and case-insensitive patterns containing an i or non-ASCII text (RE2 does not fold İ and ı onto i), still use re; \\s is expanded to the Unicode whitespace re matches')
+    parser.add_argument('--cache', action='store_true', help=f'Skip files unchanged since they last needed no cleaning (stored as {CACHE_NAME} in the git directory, or {CACHE_PATH} outside git)')
+    parser.add_argument('--include-ignored', action='store_true', help='Walk the whole tree instead of only the files git does not ignore')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes to clean files with (0 uses all CPUs)')
     args = parser.parse_args()
 
     if args.json_config:
@@ -143,7 +624,12 @@ def main():
             expanded_dirs.extend(matching_dirs)
         include_dirs = expanded_dirs
 
-    return clean_files(patterns, include_dirs, args.enforce_all)
+    if args.re2 and re2 is None:
+        logger.warning("google-re2 is not installed; falling back to re")
+
+    jobs = args.jobs or os.cpu_count() or 1
+    cache_path = default_cache_path() if args.cache else None
+    return clean_files(patterns, include_dirs, args.enforce_all, jobs, args.re2, cache_path, not args.include_ignored)
 
 if __name__ == '__main__':
     raise SystemExit(main())
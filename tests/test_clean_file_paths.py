@@ -0,0 +1,114 @@
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'custom_precommit_hooks'))
+
+import clean_file_paths  # noqa: E402
+
+
+def clean_sequentially(patterns, content):
+    # Reference behaviour: one re.sub pass per pattern, in config order
+    for pattern, options in patterns.items():
+        replacement = options.get("replacement")
+        flags = 0 if options.get("case_sensitive", True) else re.IGNORECASE
+        if options.get("inplace", False):
+            if pattern == "all":
+                regex = re.compile(r'(/[^/\s]+)+/(?P<filename>[^/]+\.[a-zA-Z0-9]+)', flags)
+                content = regex.sub(lambda m: os.path.join(replacement, m.group('filename')), content)
+            else:
+                regex = re.compile(rf'{re.escape(pattern)}[^\s]*', flags)
+                content = regex.sub(lambda m: os.path.join(replacement, os.path.basename(m.group(0))), content)
+        else:
+            regex = re.compile(rf'(?P<key>{re.escape(pattern)})(\s*=\s*)(?P<value>[^\n]*)', flags)
+            content = regex.sub(lambda m: f"{m.group('key')} = {replacement}", content)
+    return content
+
+
+def clean(patterns, content, use_re2=False):
+    cleaner = clean_file_paths.PatternCleaner(clean_file_paths.compile_patterns(patterns, use_re2))
+    return cleaner.run(content)[1]
+
+
+def test_chained_path_rewrites_match_sequential_passes():
+    patterns = {
+        "/PMBB": {"replacement": "/data", "inplace": True},
+        "/project": {"replacement": "/proj", "inplace": True},
+    }
+    content = "cp /PMBB/run/project.txt .\n"
+    assert clean(patterns, content) == clean_sequentially(patterns, content) == "cp /data/proj/project.txt .\n"
+
+
+def test_replacement_rewritten_by_later_pattern():
+    patterns = {
+        "/PMBB": {"replacement": "/project", "inplace": True},
+        "/project": {"replacement": "/X", "inplace": True},
+        "API_KEY": {"replacement": "1"},
+        "KEY": {"replacement": "2"},
+    }
+    content = "a /PMBB/x/y.txt b\nAPI_KEY = a\nKEY=b\n"
+    assert clean(patterns, content) == clean_sequentially(patterns, content)
+
+
+def test_random_configs_match_sequential_passes():
+    rng = random.Random(1234)
+    keys = ["KEY", "API_KEY", "TOKEN", "s", "k", "i", "/PMBB", "/project", "/data", "/p", "all"]
+    replacements = ["/data", "/proj", "/p/KEY", "KEY", "x", "s", "ſ", "K"]
+    pieces = keys + ["ſ", "K", "İ", " ", " = ", "=", "\n", "/", "x.txt", "project.txt", "\xa0", "run"]
+    for _ in range(3000):
+        patterns = {}
+        for key in rng.sample(keys, rng.randint(1, 4)):
+            patterns[key] = {
+                "replacement": rng.choice(replacements),
+                "inplace": key == "all" or (key.startswith("/") and rng.random() < 0.8),
+                "case_sensitive": rng.random() < 0.5,
+            }
+        content = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 20)))
+        assert clean(patterns, content) == clean_sequentially(patterns, content), (patterns, content)
+
+
+def test_re2_matches_unicode_whitespace_like_re():
+    pytest.importorskip('re2')
+    patterns = {"/PMBB": {"replacement": "/data", "inplace": True}}
+    content = "cp /PMBB/x/y.txt\xa0/tmp/z.txt\n"
+    assert clean(patterns, content, use_re2=True) == clean_sequentially(patterns, content) == "cp /data/y.txt\xa0/tmp/z.txt\n"
+
+
+def test_re2_random_configs_match_sequential_passes():
+    pytest.importorskip('re2')
+    rng = random.Random(5678)
+    keys = ["KEY", "API_KEY", "s", "k", "i", "/PMBB", "/project", "/p", "all"]
+    pieces = keys + ["ſ", "K", "İ", "ı", " ", " = ", "=", "\n", "/", "x.txt", "\xa0", " ", "\x1c", "\v"]
+    for _ in range(1000):
+        patterns = {}
+        for key in rng.sample(keys, rng.randint(1, 4)):
+            patterns[key] = {
+                "replacement": rng.choice(["/data", "/proj", "KEY"]),
+                "inplace": key == "all" or (key.startswith("/") and rng.random() < 0.8),
+                "case_sensitive": rng.random() < 0.5,
+            }
+        content = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 20)))
+        assert clean(patterns, content, use_re2=True) == clean_sequentially(patterns, content), (patterns, content)
+
+
+def test_write_file_keeps_hard_links(tmp_path):
+    target = tmp_path / "a.txt"
+    target.write_text("old\n")
+    os.link(target, tmp_path / "b.txt")
+    clean_file_paths.write_file(str(target), "new\n")
+    assert (tmp_path / "b.txt").read_text() == "new\n"
+
+
+def test_write_file_in_place_without_temporary_file(tmp_path, monkeypatch):
+    target = tmp_path / "a.txt"
+    target.write_text("old\n")
+
+    def refuse(*args, **kwargs):
+        raise PermissionError("read-only directory")
+
+    monkeypatch.setattr(clean_file_paths.tempfile, "NamedTemporaryFile", refuse)
+    clean_file_paths.write_file(str(target), "new\n")
+    assert target.read_text() == "new\n"